@@ -1,17 +1,28 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from django.views.decorators.cache import cache_page
+from django.views.generic import TemplateView
 
 app_name = 'coastal_cabana'
 
+# (route, name) for each static page; the template is coastal_cabana/<name>.html
+PAGES = [
+    ('', 'homepage'),                                          # Hero banner and key project highlights
+    ('project-overview/', 'project_overview'),                 # Developer info and key selling points
+    ('location/', 'location'),                                 # Map, connectivity, and amenities
+    ('site-plan-facilities/', 'site_plan_facilities'),         # Site plan and amenities list
+    ('floor-plans/', 'floor_plans'),                           # All unit types
+    ('unit-mix-pricing/', 'unit_mix_pricing'),                 # Unit mix and pricing information
+    ('eligibility-guide/', 'eligibility_guide'),               # Eligibility and purchase guide for EC buyers
+    ('showflat-booking/', 'showflat_booking'),                 # Showflat and booking information
+    ('gallery/', 'gallery'),                                   # Image and video gallery
+    ('contact/', 'contact'),                                   # Contact forms and details
+]
+
+# The pages have no per-request content, so whole responses are cached
+page_cache = cache_page(settings.PAGE_CACHE_TIMEOUT)
+
 urlpatterns = [
-    path('', views.homepage, name='homepage'),
-    path('project-overview/', views.project_overview, name='project_overview'),
-    path('location/', views.location, name='location'),
-    path('site-plan-facilities/', views.site_plan_facilities, name='site_plan_facilities'),
-    path('floor-plans/', views.floor_plans, name='floor_plans'),
-    path('unit-mix-pricing/', views.unit_mix_pricing, name='unit_mix_pricing'),
-    path('eligibility-guide/', views.eligibility_guide, name='eligibility_guide'),
-    path('showflat-booking/', views.showflat_booking, name='showflat_booking'),
-    path('gallery/', views.gallery, name='gallery'),
-    path('contact/', views.contact, name='contact'),
+    path(route, page_cache(TemplateView.as_view(template_name=f'coastal_cabana/{name}.html')), name=name)
+    for route, name in PAGES
 ]
\ No newline at end of file
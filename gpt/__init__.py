@@ -7,6 +7,8 @@ It handles asynchronous requests, automatic retries, cost tracking, and structur
 Main Functions:
     - gpt_request: Asynchronous GPT request handler with automatic cost tracking
     - render_template: Jinja2 template rendering for prompts
+    - get_client / close_client: Access or shut down the shared AsyncOpenAI client
+    - client_session: Async context manager that closes the shared client on exit
 
 Usage:
     from gpt import gpt_request, render_template
@@ -22,9 +24,33 @@ Usage:
     prompt = render_template('my_prompt.txt', variable='value')
 """
 
-# Import main functions for easy access
-from .gpt_requests import gpt_request
+import importlib
+
+# render_template is imported eagerly (jinja2 is cheap): its submodule has the
+# same name, so importing gpt.render_template first would otherwise leave the
+# package attribute pointing at the module instead of the function
 from .render_template import render_template
 
+# Names from gpt_requests, imported on first access (PEP 562) so that
+# "import gpt" does not pull in openai and httpx until they are needed
+_LAZY_IMPORTS = {
+    'gpt_request': '.gpt_requests',
+    'get_client': '.gpt_requests',
+    'close_client': '.gpt_requests',
+    'client_session': '.gpt_requests',
+}
+
 # Define what gets imported with "from gpt import *"
-__all__ = ['gpt_request', 'render_template']
+__all__ = ['gpt_request', 'get_client', 'close_client', 'client_session', 'render_template']
+
+
+def __getattr__(name):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -10,15 +10,20 @@ Provides asynchronous OpenAI API calls with:
 """
 
 import httpx
-from openai import AsyncOpenAI, LengthFinishReasonError
+from openai import AsyncOpenAI, DefaultAioHttpClient, LengthFinishReasonError
 from pydantic import BaseModel 
 import re
 import json
 import asyncio
+import hashlib
 import os
+import time
 import logging
-import traceback
 import platform
+import weakref
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from contextvars import ContextVar
 from dotenv import load_dotenv
 
 from tenacity import (
@@ -30,69 +35,384 @@ from tenacity import (
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Set event loop policy for Windows
-if platform.system == "Windows":    
+if platform.system() == "Windows":    
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+else:
+    # Use uvloop's libuv-based event loop on POSIX when it is installed
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+# Price lookup table (per 1000 tokens), read on first use by _load_prices()
+PRICE_LUT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'price_lut.json')
+_prices = None
+
+
+def _load_prices():
+    """
+    Return (price_lut, PRICE_PER_TOKEN), reading price_lut.json on first call.
+    
+    PRICE_PER_TOKEN maps each model to its (prompt, completion) price per
+    single token. Both are also available as module attributes.
+    """
+    global _prices
+    if _prices is None:
+        with open(PRICE_LUT_PATH) as f:
+            lut = json.load(f)
+        per_token = {
+            model: (pricing['prompt_price'] / 1000, pricing['completion_price'] / 1000)
+            for model, pricing in lut.items()
+        }
+        _prices = (lut, per_token)
+    return _prices
+
+
+def __getattr__(name):
+    # Keep "from gpt.gpt_requests import price_lut" working without loading it at import
+    if name == 'price_lut':
+        return _load_prices()[0]
+    if name == 'PRICE_PER_TOKEN':
+        return _load_prices()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Shared OpenAI client, created on first use by get_client()
+client = None
+
+# Maximum number of API calls in flight at once (tune to the account's rate tier)
+MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', '64'))
+
+# One semaphore per event loop, since asyncio primitives cannot be shared across loops
+_semaphores = weakref.WeakKeyDictionary()
+
+# Model of the request being sent from the current task, read by the response hook
+_current_model = ContextVar('_current_model', default=None)
+
+# Patterns used by clean_output on every response
+_BLANK_LINES = re.compile(r'\n{2,}')
+_EDGE_NEWLINES = re.compile(r'^\n|\n$')
+_EDGE_QUOTES = re.compile(r'^"|"$')
+
+# Durations in x-ratelimit-reset-* headers, e.g. "20ms", "1s", "6m0s"
+_RESET_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_RESET_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+class HeaderRateLimiter:
+    """
+    Pre-emptive per-model rate limiter driven by OpenAI's x-ratelimit-* headers.
+    
+    Every response reports how many requests and tokens are left in the
+    current window and when each window resets. Before sending, acquire()
+    checks that budget (less what has been spent since) and sleeps until the
+    reset when it would be exceeded, instead of sending a request that comes
+    back as a 429 and then waits out tenacity's backoff.
+    Models that have not been seen yet are never delayed.
+    """
 
-# Load price lookup table
-with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'price_lut.json')) as f: 
-    price_lut = json.load(f)
+    def __init__(self):
+        self.limits = {}
 
-# Initialize OpenAI client
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
-client = AsyncOpenAI(api_key=OPENAI_API_KEY,
-                     http_client=httpx.AsyncClient(
-            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
-        ))
+    def update(self, model, headers):
+        """Record the budget reported by a response for model."""
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        if remaining_requests is None or remaining_tokens is None:
+            return
+        now = time.monotonic()
+        self.limits[model] = {
+            'requests': int(remaining_requests),
+            'tokens': int(remaining_tokens),
+            'requests_reset': now + _parse_reset(headers.get('x-ratelimit-reset-requests')),
+            'tokens_reset': now + _parse_reset(headers.get('x-ratelimit-reset-tokens')),
+        }
+
+    async def acquire(self, model, tokens):
+        """Wait until model has budget for one request of about tokens tokens, then spend it."""
+        while True:
+            state = self.limits.get(model)
+            if state is None:
+                return
+            now = time.monotonic()
+            wait = 0
+            if state['requests'] < 1 and now < state['requests_reset']:
+                wait = state['requests_reset'] - now
+            if state['tokens'] < tokens and now < state['tokens_reset']:
+                wait = max(wait, state['tokens_reset'] - now)
+            if wait <= 0:
+                state['requests'] -= 1
+                state['tokens'] -= tokens
+                return
+            await asyncio.sleep(wait)
+
+
+def _parse_reset(value):
+    """Convert a reset duration such as "6m0s" to seconds (0 if missing)."""
+    if not value:
+        return 0
+    return sum(float(amount) * _RESET_UNITS[unit] for amount, unit in _RESET_PART.findall(value))
+
+
+rate_limiter = HeaderRateLimiter()
+
+
+class PromptCache:
+    """
+    In-process LRU of outputs for repeated deterministic requests.
+    
+    Entries expire after ttl seconds and the least recently used entry is
+    dropped once maxsize is reached. Pydantic outputs are copied on the way
+    in and out so a caller mutating its result cannot change what later
+    callers get back.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached output for key, or None if missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, output = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return _detach(output)
+
+    def set(self, key, output):
+        self.entries[key] = (time.monotonic(), _detach(output))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+def _detach(output):
+    return output.model_copy(deep=True) if isinstance(output, BaseModel) else output
+
+
+# Outputs of identical temperature-0 requests are reused for a day (0 disables the cache)
+prompt_cache = PromptCache(int(os.environ.get('OPENAI_RESPONSE_CACHE_SIZE', '4096')), 24 * 60 * 60)
+
+
+def _cache_key(params, encoded_messages):
+    """
+    Return the prompt key of a request that may be cached, or None if it must
+    not be (sampling with temperature > 0, tool calls, or the cache is disabled).
+    """
+    if prompt_cache.maxsize <= 0 or (params.get('temperature') or 0) > 0 or params.get('tools'):
+        return None
+    return _prompt_key(params, encoded_messages)
+
+
+def _encode_messages(messages):
+    """Serialize a request's messages; done once per request in gpt_request."""
+    return json.dumps(messages, sort_keys=True, default=str)
+
+
+def _prompt_key(params, encoded_messages):
+    """Return a digest identifying a request's prompt (given pre-encoded) and settings."""
+    key_params = {k: v for k, v in params.items() if k != 'messages'}
+    response_format = key_params.get('response_format')
+    if isinstance(response_format, type):
+        # A Pydantic model is keyed by name; a dict format is serialized below
+        key_params['response_format'] = f"{response_format.__module__}.{response_format.__qualname__}"
+    payload = encoded_messages + '\n' + json.dumps(key_params, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+async def _record_rate_limits(response):
+    """httpx response hook feeding the rate limit headers into rate_limiter."""
+    model = _current_model.get()
+    if model is not None:
+        rate_limiter.update(model, response.headers)
+
+
+def get_client():
+    """
+    Return the process-wide AsyncOpenAI client, creating it on first use.
+    
+    Every request goes through this one client so its connection pool (and
+    the TCP/TLS connections in it) is reused across gpt_request calls instead
+    of being rebuilt per request.
+    """
+    global client
+    if client is None:
+        client = AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'),
+                             http_client=_build_http_client())
+    return client
+
+
+def _build_http_client():
+    """
+    Build the HTTP transport for the shared client.
+    
+    Prefers the SDK's aiohttp-backed client, which holds up much better than
+    plain httpx with many requests in flight. Falls back to httpx when openai
+    is installed without the aiohttp extra.
+    """
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    event_hooks = {'response': [_record_rate_limits]}
+    try:
+        return DefaultAioHttpClient(limits=limits, event_hooks=event_hooks)
+    except RuntimeError:
+        logger.info("openai[aiohttp] not installed, using the httpx transport")
+        return httpx.AsyncClient(limits=limits, event_hooks=event_hooks)
+
+
+async def close_client():
+    """Close the shared client's connection pool; the next get_client() starts a new one."""
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+
+@asynccontextmanager
+async def client_session():
+    """
+    Keep the shared client open for a block of requests and close it on exit.
+    
+    Pooled connections belong to the event loop that opened them, so wrap
+    the gpt_request calls made inside one asyncio.run() in this block to shut
+    the pool down cleanly before that loop ends:
+    
+        async with client_session():
+            outputs, cost = await gpt_request(__name__, params_list)
+    """
+    try:
+        yield get_client()
+    finally:
+        await close_client()
+
+def _get_semaphore():
+    """Return the semaphore that caps in-flight API calls on the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return semaphore
 
 def clean_output(output):
     if not isinstance(output, str):
         return output
-    output = output.replace("\n\n", "\n")
+    # nothing to clean in the common single-line, unquoted case
+    if '\n' not in output and not output.startswith('"') and not output.endswith('"'):
+        return output
+    # collapse runs of blank lines to a single newline
+    output = _BLANK_LINES.sub('\n', output)
     # remove \n from the start and end of the string if they exist
-    output = re.sub(r'^\n|\n$', '', output)
+    output = _EDGE_NEWLINES.sub('', output)
     # replace '"' at the start and end of the string if they exist
-    output = re.sub(r'^"|"$', '', output)
+    output = _EDGE_QUOTES.sub('', output)
     return output
 
 
+# Request parameters accepted in a params dict, with their defaults
+DEFAULT_PARAMS = {
+    'model': "gpt-3.5-turbo-1106",
+    'temperature': 0,
+    'max_tokens': 1000,
+    'top_p': 1,
+    'frequency_penalty': 0,
+    'presence_penalty': 0,
+    'stop': None,
+    'logit_bias': None,
+    'tools': None,
+    'tool_choice': None,
+    'response_format': None,
+    'n': 1,
+}
+
+
+def validate_params(params):
+    """Raise TypeError if a params dict has no messages or uses an unknown key."""
+    if 'messages' not in params:
+        raise TypeError("GPT request params must include 'messages'")
+    unknown = params.keys() - DEFAULT_PARAMS.keys() - {'messages'}
+    if unknown:
+        raise TypeError(f"Unknown GPT request parameter(s): {', '.join(sorted(unknown))}")
+
+
+def cost_lookup(model, prompt_tokens, completion_tokens):
+    """Return the USD cost of a response from its model and token counts."""
+    prompt_price, completion_price = _load_prices()[1][model]
+    return prompt_price * prompt_tokens + completion_price * completion_tokens
+
+
 def print_error(retry_state):
-    print("Error: ", traceback.format_exception(None, retry_state.outcome.exception(), retry_state.outcome.exception().__traceback__))
+    logger.warning("GPT request attempt %d failed: %r", retry_state.attempt_number, retry_state.outcome.exception())
 
 
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3), after=print_error, reraise=True)
-async def api_call_chat(messages, model="gpt-3.5-turbo-1106", temperature=0, max_tokens=1000, top_p=1, frequency_penalty=0, presence_penalty=0, stop=None, logit_bias=None, index=0, tools=None, tool_choice=None, response_format:BaseModel=None):
+async def api_call_chat(params, index=0, prompt_tokens=None):
+    """
+    Send one request described by a validated params dict; missing keys take
+    DEFAULT_PARAMS values. prompt_tokens is the caller's estimate of the
+    prompt size, so retries do not re-serialize the messages to work it out.
+    """
+    messages = params['messages']
+    model = params.get('model', DEFAULT_PARAMS['model'])
+    temperature = params.get('temperature', DEFAULT_PARAMS['temperature'])
+    max_tokens = params.get('max_tokens', DEFAULT_PARAMS['max_tokens'])
+    top_p = params.get('top_p', DEFAULT_PARAMS['top_p'])
+    frequency_penalty = params.get('frequency_penalty', DEFAULT_PARAMS['frequency_penalty'])
+    presence_penalty = params.get('presence_penalty', DEFAULT_PARAMS['presence_penalty'])
+    stop = params.get('stop', DEFAULT_PARAMS['stop'])
+    logit_bias = params.get('logit_bias', DEFAULT_PARAMS['logit_bias'])
+    tools = params.get('tools', DEFAULT_PARAMS['tools'])
+    tool_choice = params.get('tool_choice', DEFAULT_PARAMS['tool_choice'])
+    response_format = params.get('response_format', DEFAULT_PARAMS['response_format'])
+    n = params.get('n', DEFAULT_PARAMS['n'])
     # print(f"requesting {prompt} from {model}")
     # Make the request to the OpenAI API
     # print(f"requesting {messages} from {model}", "messages type: ", type(messages))    
     try: 
-        if response_format:
-            response = await client.beta.chat.completions.parse(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                stop=stop,
-                logit_bias=logit_bias,
-                response_format=response_format
-            )
-        else:   
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                stop=stop,
-                logit_bias=logit_bias,
-                tools=tools,
-                tool_choice=tool_choice
-            )
+        # Hold a slot only for the call itself so retries back off without blocking others
+        async with _get_semaphore():
+            # Rough token estimate for the pre-emptive rate limit
+            if prompt_tokens is None:
+                prompt_tokens = len(_encode_messages(messages)) // 4
+            await rate_limiter.acquire(model, (max_tokens or 0) * n + prompt_tokens)
+            _current_model.set(model)
+            if response_format:
+                response = await get_client().beta.chat.completions.parse(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p,
+                    frequency_penalty=frequency_penalty,
+                    presence_penalty=presence_penalty,
+                    stop=stop,
+                    logit_bias=logit_bias,
+                    response_format=response_format,
+                    n=n
+                )
+            else:   
+                response = await get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p,
+                    frequency_penalty=frequency_penalty,
+                    presence_penalty=presence_penalty,
+                    stop=stop,
+                    logit_bias=logit_bias,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    n=n
+                )
         
         choices = response.choices
     except Exception as e:
@@ -108,71 +428,78 @@ async def api_call_chat(messages, model="gpt-3.5-turbo-1106", temperature=0, max
                 raw_content = e.errors()[0]['input'] if e.errors() else None
                 
                 if raw_content:
-                    logging.warning(f"Incomplete JSON detected, attempting to repair. Original: {raw_content[:200]}...")
+                    logger.warning("Incomplete JSON detected, attempting to repair. Original: %.200s...", raw_content)
                     
                     # Use json-repair to fix the incomplete JSON
                     repaired_json_str = repair_json(raw_content)
                     
-                    logging.info(f"Repaired JSON: {repaired_json_str}")
+                    logger.info("Repaired JSON: %s", repaired_json_str)
                     
                     # Parse the repaired JSON and instantiate the Pydantic model
                     output = response_format.model_validate_json(repaired_json_str)
-                    logging.info("Successfully parsed repaired JSON")
+                    logger.info("Successfully parsed repaired JSON")
                     
                     # Return early with repaired data (cost set to 0 since we don't have usage info)
                     return output, 0, index
                     
             except Exception as repair_error:
-                logging.error(f"Failed to repair JSON: {repair_error}")
+                logger.error("Failed to repair JSON: %s", repair_error)
                 # Fall through to original error handling
         
         # Check if this is a LengthFinishReasonError - we can still access partial content
         if isinstance(e, LengthFinishReasonError):
-            logging.warning(
-                f"LENGTH LIMIT REACHED - Partial response available:\n"
-                f"Finish Reason: length\n"
-                f"Usage: {e.completion.usage if hasattr(e, 'completion') else 'N/A'}\n"
-                f"Partial Content: {e.completion.choices[0].message.content if hasattr(e, 'completion') and e.completion.choices else 'N/A'}"
+            logger.warning(
+                "LENGTH LIMIT REACHED - Partial response available:\n"
+                "Finish Reason: length\n"
+                "Usage: %s\n"
+                "Partial Content: %s",
+                e.completion.usage if hasattr(e, 'completion') else 'N/A',
+                e.completion.choices[0].message.content if hasattr(e, 'completion') and e.completion.choices else 'N/A'
             )
             # Log the full partial response for inspection
             if hasattr(e, 'completion') and e.completion.choices:
-                logging.info(f"Full partial response object: {e.completion}")
-                logging.info(f"Partial content:\n{e.completion.choices[0].message.content}")
+                logger.info("Full partial response object: %s", e.completion)
+                logger.info("Partial content:\n%s", e.completion.choices[0].message.content)
         
-        logging.error(
-            f"ERROR:\n"
-            f"Type: {type(e)}\n"
-            f"Message: {e}\n"
-            f"Stack Trace: {traceback.format_exc()}"
-        )
+        # The traceback is only formatted if the record is actually emitted
+        logger.exception("GPT request failed (%s): %s", type(e).__name__, e)
         raise
     
-    choices[0].message.content = clean_output(choices[0].message.content)
+    for choice in choices:
+        choice.message.content = clean_output(choice.message.content)
 
     if tools:
-        output = choices[0]
+        outputs = list(choices)
     elif response_format:
-        output = choices[0].message.parsed
+        outputs = [choice.message.parsed for choice in choices]
     else:
-        output = choices[0].message.content
+        outputs = [choice.message.content for choice in choices]
     # output = clean_output(output)
 
-    model = response.model
-    prompt_tokens= response.usage.prompt_tokens
-    completion_tokens= response.usage.completion_tokens
+    # A request for n > 1 completions gets all of them as a list
+    output = outputs if n > 1 else outputs[0]
 
-    def cost_lookup(model, prompt_tokens, completion_tokens):
-        # get the pricing
-        pricing = price_lut[model]
-        # get the cost
-        prompt_cost = pricing['prompt_price'] * prompt_tokens/1000
-        completion_cost = pricing['completion_price'] * completion_tokens/1000
-        return prompt_cost + completion_cost
-
-    cost = cost_lookup(model, prompt_tokens, completion_tokens)
+    # Only the token counts are needed from the usage object
+    usage = response.usage
+    if usage is None:
+        logger.warning("No usage reported for %s; counting cost as 0", response.model)
+        cost = 0
+    else:
+        cost = cost_lookup(response.model, usage.prompt_tokens, usage.completion_tokens)
 
     return output, cost, index
 
+async def _call_with_index(params, index, prompt_tokens):
+    """
+    Run api_call_chat, returning (exception, 0, index) instead of raising once
+    retries are exhausted. index is a list of output positions for a call
+    that answers several identical requests at once.
+    """
+    try:
+        return await api_call_chat(params, index, prompt_tokens)
+    except Exception as e:
+        return e, 0, index
+
 # @cache_async()
 async def gpt_request(func_name, params_list):
     """
@@ -192,16 +519,20 @@ async def gpt_request(func_name, params_list):
                                    - temperature (float, optional): Sampling temperature (default: 0)
                                    - max_tokens (int, optional): Maximum tokens to generate (default: 1000)
                                    - response_format (BaseModel, optional): Pydantic model for structured output
+                                   - n (int, optional): Number of completions to return as a list (default: 1).
+                                     Identical requests with temperature > 0 are batched into one call this way.
                                    - top_p, frequency_penalty, presence_penalty, etc. (optional)
     
     Returns:
         tuple: (outputs, total_cost)
             - outputs (list): List of GPT responses. For structured outputs, contains Pydantic model instances.
                              For regular text, contains strings. Order matches input params_list order.
+                             A request that still failed after its retries holds the exception instead,
+                             so callers can resubmit just those params.
             - total_cost (float): Total cost in USD for all requests combined.
     
     Raises:
-        Exception: Propagates any API errors after retry attempts are exhausted.
+        TypeError: If a params dict is missing 'messages' or has an unknown key.
     
     Usage Examples:
         
@@ -248,15 +579,44 @@ async def gpt_request(func_name, params_list):
         outputs, total_cost = await gpt_request(__name__, params_list)
         *results = outputs  # Unpack the results directly
     """
-    print("gpt_request running")
     if not isinstance(params_list, list):
         params_list = [params_list]
+    logger.debug("gpt_request from %s: %d request(s)", func_name, len(params_list))
+        
+    # Reject malformed params before any request is sent
+    for params in params_list:
+        validate_params(params)
         
     outputs = [""] * len(params_list)
+    cache_keys = [None] * len(params_list)
+    prompt_tokens = [0] * len(params_list)
     
     tasks = []
+    samples = {}
     for i, params in enumerate(params_list):
-        tasks.append(api_call_chat(**params, index=i))
+        # Repeated deterministic prompts are answered from the cache at no cost
+        # Serialize the messages once; the encoding gives both the prompt key
+        # and the token estimate (~4 characters per token) reused across retries
+        encoded_messages = _encode_messages(params['messages'])
+        prompt_tokens[i] = len(encoded_messages) // 4
+        cache_keys[i] = _cache_key(params, encoded_messages)
+        if cache_keys[i] is not None:
+            cached = prompt_cache.get(cache_keys[i])
+            if cached is not None:
+                outputs[i] = cached
+                continue
+        # Group identical sampled requests so they can share one call
+        if (params.get('temperature') or 0) > 0 and not (params.get('tools') or 'n' in params):
+            samples.setdefault(_prompt_key(params, encoded_messages), []).append(i)
+            continue
+        tasks.append(_call_with_index(params, i, prompt_tokens[i]))
+    
+    # Each group is sent once with n set to its size: one round trip, prompt tokens billed once
+    for indices in samples.values():
+        if len(indices) == 1:
+            tasks.append(_call_with_index(params_list[indices[0]], indices[0], prompt_tokens[indices[0]]))
+        else:
+            tasks.append(_call_with_index({**params_list[indices[0]], 'n': len(indices)}, indices, prompt_tokens[indices[0]]))
     # if 'messages' in params.keys():
     #     prompt_type = 'messages'
     # else:
@@ -277,14 +637,24 @@ async def gpt_request(func_name, params_list):
     #         if 'messages' in params.keys():
     #             tasks.append(api_call_chat(**params, index=i))
     
-    api_outputs = await asyncio.gather(*tasks, return_exceptions=True)
+    # Collect results as they finish rather than holding every completion until the slowest one
     total_cost = 0
-    for api_output in api_outputs:
-        # cache.set(f'gpt_{func_name}_{str(params[i])}', await output)
-        if not isinstance(api_output, Exception):
-            output, cost, index = api_output
-            outputs[index] = output
+    for next_done in asyncio.as_completed(tasks):
+        output, cost, index = await next_done
+        if isinstance(index, list):
+            # Fan the n completions (or the shared exception) back out to the grouped requests
+            group_outputs = output if isinstance(output, list) else [output] * len(index)
+            for i, group_output in zip(index, group_outputs):
+                outputs[i] = group_output
             total_cost += cost
+            continue
+        # A failed request leaves its exception in place of the output
+        outputs[index] = output
+        if isinstance(output, Exception):
+            continue
+        total_cost += cost
+        if cache_keys[index] is not None:
+            prompt_cache.set(cache_keys[index], output)
     
     return outputs, total_cost
 
@@ -8,10 +8,15 @@ Useful for creating dynamic prompts from templates.
 from jinja2 import Environment, FileSystemLoader
 
 
-def render_template(template_name, **kwargs):
-    # Set up Jinja2 environment
-    env = Environment(loader=FileSystemLoader('prompts'))
+# Shared Jinja2 environment; its template cache keeps compiled templates in
+# memory and only re-parses a file when it changes on disk
+env = Environment(loader=FileSystemLoader('prompts'), cache_size=400)
+
+# Deletes double quotes via str.translate
+_QUOTE_TABLE = str.maketrans('', '', '"')
 
+
+def render_template(template_name, **kwargs):
     # Make JSON safe if str
     for k, v in kwargs.items():
         kwargs[k] = replace_in_value(v)
@@ -23,11 +28,35 @@ def render_template(template_name, **kwargs):
     return template.render(**kwargs)
 
 def replace_in_value(value):
-    if isinstance(value, str):
-        return value.replace('"', '')
-    elif isinstance(value, dict):
-        return {k: replace_in_value(v) for k, v in value.items()}
-    elif isinstance(value, list):
-        return [replace_in_value(v) for v in value]
-    else:
-        return value
+    """
+    Return a copy of value with double quotes removed from every string in it.
+    
+    Nested dicts and lists are walked with an explicit stack rather than
+    recursion, and strings without a quote are passed through unchanged.
+    """
+    if not isinstance(value, (dict, list)):
+        return _strip_quotes(value)
+
+    result = {} if isinstance(value, dict) else []
+    stack = [(value, result)]
+    while stack:
+        source, target = stack.pop()
+        items = source.items() if isinstance(source, dict) else enumerate(source)
+        for key, item in items:
+            if isinstance(item, (dict, list)):
+                copy = {} if isinstance(item, dict) else []
+                stack.append((item, copy))
+                item = copy
+            else:
+                item = _strip_quotes(item)
+
+            if isinstance(target, dict):
+                target[key] = item
+            else:
+                target.append(item)
+    return result
+
+def _strip_quotes(value):
+    if isinstance(value, str) and '"' in value:
+        return value.translate(_QUOTE_TABLE)
+    return value
@@ -19,6 +19,21 @@ def ensure_api_key():
     return api_key
 
 
+@pytest.fixture(autouse=True)
+def empty_prompt_cache(monkeypatch):
+    """Give every test an empty prompt cache so no answer carries over between tests."""
+    from gpt.gpt_requests import PromptCache
+    monkeypatch.setattr('gpt.gpt_requests.prompt_cache', PromptCache(4096, 60))
+
+
+@pytest.fixture(autouse=True)
+async def close_shared_client():
+    """Close the shared client after each test; its connection pool belongs to the test's event loop."""
+    yield
+    from gpt.gpt_requests import close_client
+    await close_client()
+
+
 @pytest.fixture
 def sample_messages():
     """Provide sample messages for testing."""
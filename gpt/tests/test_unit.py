@@ -26,12 +26,16 @@ def test_clean_output():
     
     # Test removing double newlines
     assert clean_output("hello\n\nworld") == "hello\nworld"
+    assert clean_output("hello\n\n\n\nworld") == "hello\nworld"
     
     # Test removing leading/trailing newlines
     assert clean_output("\nhello\n") == "hello"
     
     # Test removing leading/trailing quotes
     assert clean_output('"hello"') == "hello"
+    assert clean_output('"hello') == "hello"
+    assert clean_output('say "hi"') == 'say "hi'
+    assert clean_output("hello") == "hello"
     
     # Test non-string input
     assert clean_output(123) == 123
@@ -40,7 +44,7 @@ def test_clean_output():
 @pytest.mark.unit
 def test_cost_calculation():
     """Test cost calculation logic without API call."""
-    from gpt.gpt_requests import price_lut
+    from gpt.gpt_requests import price_lut, cost_lookup
     
     # Test that price_lut is loaded
     assert isinstance(price_lut, dict)
@@ -60,6 +64,7 @@ def test_cost_calculation():
         
         assert total_cost > 0
         assert isinstance(total_cost, float)
+        assert cost_lookup(model, 100, 50) == pytest.approx(total_cost)
 
 
 @pytest.mark.unit
@@ -118,6 +123,239 @@ async def test_concurrent_requests_with_mock(mock_openai_client):
     assert total_cost > 0
 
 
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_concurrency_limit(mock_openai_client, mock_openai_response, monkeypatch):
+    """Test that no more than MAX_CONCURRENCY calls are in flight at once."""
+    import asyncio
+    from gpt import gpt_request, gpt_requests
+    
+    monkeypatch.setattr(gpt_requests, 'MAX_CONCURRENCY', 2)
+    in_flight = 0
+    peak = 0
+    
+    async def slow_create(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return mock_openai_response
+    
+    mock_openai_client.chat.completions.create.side_effect = slow_create
+    params_list = [
+        {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': f'Test {i}'}]}
+        for i in range(6)
+    ]
+    
+    outputs, total_cost = await gpt_request(__name__, params_list)
+    
+    assert outputs == ["Mocked response"] * 6
+    assert peak == 2
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_rate_limiter_waits_for_reset():
+    """Test that HeaderRateLimiter holds requests until the reported window resets."""
+    import time
+    from gpt.gpt_requests import HeaderRateLimiter
+    
+    limiter = HeaderRateLimiter()
+    
+    # Unknown models are never delayed
+    start = time.monotonic()
+    await limiter.acquire('gpt-4o-mini', 100)
+    assert time.monotonic() - start < 0.05
+    
+    # No requests left: wait for the request window to reset
+    limiter.update('gpt-4o-mini', {
+        'x-ratelimit-remaining-requests': '0',
+        'x-ratelimit-remaining-tokens': '10000',
+        'x-ratelimit-reset-requests': '100ms',
+        'x-ratelimit-reset-tokens': '0s',
+    })
+    start = time.monotonic()
+    await limiter.acquire('gpt-4o-mini', 100)
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_max_tokens_none_accepted(mock_openai_client):
+    """Test that max_tokens=None is passed through instead of breaking the rate limit estimate."""
+    from gpt import gpt_request
+    
+    outputs, _ = await gpt_request(__name__, {
+        'model': 'gpt-4o-mini',
+        'messages': [{'role': 'user', 'content': 'Test'}],
+        'max_tokens': None
+    })
+    
+    assert outputs == ["Mocked response"]
+    assert mock_openai_client.chat.completions.create.call_count == 1
+    assert mock_openai_client.chat.completions.create.call_args.kwargs['max_tokens'] is None
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_response_cache(mock_openai_client):
+    """Test that repeated temperature-0 prompts are served from the cache at no cost."""
+    from gpt import gpt_request
+    
+    params = {
+        'model': 'gpt-4o-mini',
+        'messages': [{'role': 'user', 'content': 'Cached'}],
+        'temperature': 0
+    }
+    
+    first, first_cost = await gpt_request(__name__, params)
+    second, second_cost = await gpt_request(__name__, params)
+    
+    assert first == second == ["Mocked response"]
+    assert first_cost > 0
+    assert second_cost == 0
+    assert mock_openai_client.chat.completions.create.call_count == 1
+    
+    # Sampled requests are never cached
+    params['temperature'] = 0.7
+    await gpt_request(__name__, params)
+    await gpt_request(__name__, params)
+    assert mock_openai_client.chat.completions.create.call_count == 3
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_prompt_cache_with_dict_response_format(mock_openai_client, mock_openai_response):
+    """Test that a dict response_format and temperature=None are cached like other deterministic prompts."""
+    from gpt import gpt_request
+    
+    mock_openai_response.choices[0].message.parsed = {'greeting': 'hello'}
+    mock_openai_client.beta.chat.completions.parse.return_value = mock_openai_response
+    params = {
+        'model': 'gpt-4o-mini',
+        'messages': [{'role': 'user', 'content': 'Cached JSON'}],
+        'temperature': None,
+        'response_format': {'type': 'json_object'}
+    }
+    
+    first, _ = await gpt_request(__name__, params)
+    second, second_cost = await gpt_request(__name__, params)
+    
+    assert first == second == [{'greeting': 'hello'}]
+    assert second_cost == 0
+    assert mock_openai_client.beta.chat.completions.parse.call_count == 1
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_invalid_params_rejected(mock_openai_client):
+    """Test that malformed params are rejected before any request is sent."""
+    from gpt import gpt_request
+    
+    with pytest.raises(TypeError, match='temprature'):
+        await gpt_request(__name__, {
+            'model': 'gpt-4o-mini',
+            'messages': [{'role': 'user', 'content': 'Test'}],
+            'temprature': 0
+        })
+    
+    with pytest.raises(TypeError, match='messages'):
+        await gpt_request(__name__, {'model': 'gpt-4o-mini'})
+    
+    assert not mock_openai_client.chat.completions.create.called
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_failed_request_keeps_exception(mock_openai_client, mock_openai_response, monkeypatch):
+    """Test that a request failing after retries leaves its exception at its index."""
+    from tenacity import wait_none
+    from gpt import gpt_request, gpt_requests
+    
+    monkeypatch.setattr(gpt_requests.api_call_chat.retry, 'wait', wait_none())
+    
+    async def create(**kwargs):
+        if kwargs['messages'][0]['content'] == 'Bad':
+            raise RuntimeError('boom')
+        return mock_openai_response
+    
+    mock_openai_client.chat.completions.create.side_effect = create
+    params_list = [
+        {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': content}]}
+        for content in ['Good', 'Bad']
+    ]
+    
+    outputs, total_cost = await gpt_request(__name__, params_list)
+    
+    assert outputs[0] == "Mocked response"
+    assert isinstance(outputs[1], Exception)
+    assert total_cost > 0
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_identical_sampled_requests_share_one_call(mock_openai_client, mock_openai_response):
+    """Test that identical temperature > 0 requests are sent once with n set."""
+    from gpt import gpt_request
+    
+    choices = []
+    for text in ['one', 'two', 'three']:
+        choice = Mock()
+        choice.message.content = text
+        choices.append(choice)
+    mock_openai_response.choices = choices
+    
+    params = {
+        'model': 'gpt-4o-mini',
+        'messages': [{'role': 'user', 'content': 'Sample'}],
+        'temperature': 0.8
+    }
+    
+    outputs, total_cost = await gpt_request(__name__, [params, params, params])
+    
+    assert mock_openai_client.chat.completions.create.call_count == 1
+    assert mock_openai_client.chat.completions.create.call_args.kwargs['n'] == 3
+    assert outputs == ['one', 'two', 'three']
+    assert total_cost > 0
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_shared_client(monkeypatch):
+    """Test that get_client reuses one client until close_client is called."""
+    from gpt import gpt_requests
+    
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+    monkeypatch.setattr(gpt_requests, 'client', None)
+    
+    first = gpt_requests.get_client()
+    assert gpt_requests.get_client() is first
+    
+    # Closing drops the client so the next call builds a fresh pool
+    await gpt_requests.close_client()
+    assert gpt_requests.client is None
+    
+    second = gpt_requests.get_client()
+    assert second is not first
+    await gpt_requests.close_client()
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_client_session(monkeypatch):
+    """Test that client_session closes the shared client when the block ends."""
+    from gpt import gpt_requests, client_session
+    
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+    monkeypatch.setattr(gpt_requests, 'client', None)
+    
+    async with client_session() as session_client:
+        assert gpt_requests.get_client() is session_client
+    
+    assert gpt_requests.client is None
+
+
 @pytest.mark.unit
 def test_template_rendering():
     """Test Jinja2 template rendering (no API involved)."""
@@ -205,3 +443,12 @@ def test_replace_in_value():
     # Test non-string
     assert replace_in_value(123) == 123
     assert replace_in_value(None) is None
+
+
+@pytest.mark.unit
+def test_render_template_export_after_submodule_import():
+    """Test that importing the gpt.render_template submodule keeps the function export."""
+    import gpt.render_template
+    from gpt import render_template
+    
+    assert callable(render_template)
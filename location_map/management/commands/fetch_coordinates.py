@@ -1,12 +1,13 @@
-import requests
-import json
-import time
 import os
 import asyncio
+import copy
+import hashlib
+import httpx
+from types import MappingProxyType
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from pydantic import BaseModel, Field
-from gpt import gpt_request
+from location_map.utils import CACHE_DIR, COORDINATES_PATH, RateLimiter, ResponseCache, load_json, write_json_atomic
 
 
 class LocationSubcategory(BaseModel):
@@ -23,15 +24,37 @@ class Command(BaseCommand):
         python manage.py fetch_coordinates "Pasir Ris Park" "Pasir Ris Beach" --category "Parks & Recreation"
         python manage.py fetch_coordinates "NTUC FairPrice" --condo "Coastal Cabana EC"
         python manage.py fetch_coordinates "School A" "School B" --category "Schools" --condo "My Condo"
+        python manage.py fetch_coordinates "Pasir Ris Park" --refresh
+        python manage.py fetch_coordinates "Pasir Ris Park" --api-key YOUR_SERPAPI_API_KEY
+        python manage.py fetch_coordinates "Pasir Ris Park" "Downtown East" --concurrency 10 --rate 10
     '''
 
-    # SerpAPI Key
-    API_KEY = "21d97bf1d17bccaf9b9b70da56389ce607d60fcb35bc8406b4c1342cde955aa3"
-    
     # Singapore coordinates (default search center)
     SINGAPORE_LAT = 1.3521
     SINGAPORE_LNG = 103.8198
 
+    # SerpAPI endpoint, and default limits on searches in flight and started per second
+    SERPAPI_URL = "https://serpapi.com/search.json"
+    MAX_CONCURRENT_SEARCHES = 5
+    MAX_SEARCHES_PER_SECOND = 5
+
+    # Query parameters shared by every search; only q, ll and the key vary
+    _BASE_PARAMS = MappingProxyType({
+        "engine": "google_maps",
+        "type": "search",
+        "hl": "en",
+        "google_domain": "google.com"
+    })
+
+    # Rate-limited and server-error responses are retried with exponential backoff
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    MAX_RETRIES = 4
+    RETRY_BACKOFF = 0.5
+
+    # SerpAPI responses are cached on disk and reused for 30 days
+    SERPAPI_CACHE_PATH = os.path.join(CACHE_DIR, 'serpapi.jsonl')
+    SERPAPI_CACHE_TTL = 30 * 24 * 60 * 60
+
     def add_arguments(self, parser):
         parser.add_argument(
             'locations',
@@ -51,29 +74,55 @@ class Command(BaseCommand):
             default='Coastal Cabana EC Pasir Ris',
             help='Condo location to fetch (default: "Coastal Cabana EC Pasir Ris")'
         )
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help='Ignore cached SerpAPI responses and query the API again'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=self.MAX_CONCURRENT_SEARCHES,
+            help=f'Maximum SerpAPI searches in flight at once (default: {self.MAX_CONCURRENT_SEARCHES})'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=self.MAX_SEARCHES_PER_SECOND,
+            help=f'Maximum SerpAPI searches started per second, 0 for no limit (default: {self.MAX_SEARCHES_PER_SECOND})'
+        )
+        parser.add_argument(
+            '--api-key',
+            type=str,
+            help='SerpAPI key (defaults to SERPAPI_API_KEY from settings)'
+        )
 
-    def search_location(self, query, lat=None, lng=None):
-        """Search for a location using SerpAPI Google Maps"""
-        url = "https://serpapi.com/search.json"
+    def get_api_key(self, options):
+        """Get API key from command line or settings"""
+        api_key = options.get('api_key')
+        if not api_key:
+            api_key = getattr(settings, 'SERPAPI_API_KEY', None)
         
+        if not api_key:
+            raise ValueError(
+                "SerpAPI key is required. "
+                "Provide via --api-key or set SERPAPI_API_KEY in settings"
+            )
+        
+        return api_key
+
+    async def search_location(self, client, query, lat=None, lng=None):
+        """Search for a location using SerpAPI Google Maps"""
         # Use provided coordinates or default to Singapore
         if lat is not None and lng is not None:
             ll_param = f"@{lat},{lng},14z"
         else:
             ll_param = f"@{self.SINGAPORE_LAT},{self.SINGAPORE_LNG},14z"
         
-        params = {
-            "engine": "google_maps",
-            "q": f"{query}",
-            "ll": ll_param,
-            "type": "search",
-            "hl": "en",
-            "google_domain": "google.com",
-            "api_key": self.API_KEY
-        }
+        params = {**self._BASE_PARAMS, "q": query, "ll": ll_param, "api_key": self.api_key}
         
         try:
-            response = requests.get(url, params=params)
+            response = await self.get_with_retries(client, params)
             response.raise_for_status()
             data = response.json()
             
@@ -101,10 +150,131 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING(f"No results found for: {query}"))
             return None
             
-        except Exception as e:
+        except (httpx.HTTPError, ValueError) as e:
             self.stdout.write(self.style.ERROR(f"Error searching for {query}: {e}"))
             return None
 
+    async def get_with_retries(self, client, params):
+        """
+        GET the SerpAPI endpoint, retrying transient failures.
+        
+        Connection errors, timeouts and RETRY_STATUSES responses are retried
+        up to MAX_RETRIES times, waiting RETRY_BACKOFF seconds doubled on each
+        attempt, or as long as a Retry-After header asks. The last response
+        is returned (or the last error raised) once retries run out.
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            delay = self.RETRY_BACKOFF * 2 ** attempt
+            try:
+                response = await client.get(self.SERPAPI_URL, params=params)
+            except httpx.TransportError:
+                if attempt == self.MAX_RETRIES:
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.MAX_RETRIES:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+            await asyncio.sleep(delay)
+
+    async def cached_search(self, client, query, lat, lng):
+        """
+        Search for a location, serving repeat queries from the SerpAPI cache.
+        
+        The cache is checked before waiting for a search slot, so cached
+        places never queue behind live requests. Identical searches that are
+        already in flight share that one request instead of issuing another.
+        Only successful lookups are cached; misses and errors are retried on
+        the next run.
+        
+        Queries are matched case-insensitively with whitespace collapsed, and
+        search centres within ~100 m (3 decimal places) of each other share
+        entries, so "Pasir Ris Park" and "pasir ris  park" hit the same cache.
+        """
+        cache_key = self.search_cache_key(query, lat, lng)
+        result = None if self.refresh else self.cache.get(cache_key)
+
+        if result is None:
+            search = self.inflight_searches.get(cache_key)
+            if search is None:
+                search = asyncio.ensure_future(self._search_and_store(client, cache_key, query, lat, lng))
+                self.inflight_searches[cache_key] = search
+            result = await search
+
+        # A shared result may come from a differently-written query; keep this one's name
+        return {**result, "name": query} if result else result
+
+    @staticmethod
+    def canonical_query(query):
+        """Return query with differences in case and whitespace folded away."""
+        return ' '.join(query.casefold().split())
+
+    @classmethod
+    def search_cache_key(cls, query, lat, lng):
+        """Return the cache key for a search, canonicalizing the query text and centre."""
+        return hashlib.sha1(f"{cls.canonical_query(query)}|{round(lat, 3)}|{round(lng, 3)}".encode('utf-8')).hexdigest()
+
+    async def _search_and_store(self, client, cache_key, query, lat, lng):
+        """Run one live search under the concurrency limit and cache a successful result."""
+        try:
+            async with self.search_slots:
+                await asyncio.sleep(self.rate_limiter.reserve())
+                result = await self.search_location(client, query, lat=lat, lng=lng)
+        finally:
+            del self.inflight_searches[cache_key]
+
+        if result:
+            self.cache.set(cache_key, result)
+        return result
+
+    async def fetch_all_locations(self, condo_query, condo, places):
+        """
+        Fetch the condo (if needed) and all places over one pooled HTTP client.
+        
+        The condo is looked up first because its coordinates centre the
+        searches for the places, which are then issued concurrently with at
+        most self.concurrency requests in flight, started no faster than
+        self.rate_limiter allows.
+        
+        Args:
+            condo_query (str): Condo name to search for
+            condo (dict or None): Existing condo record; fetched when None
+            places (list): Location names to search for
+            
+        Returns:
+            tuple: (condo, coords_list) where coords_list matches the order
+                   of places and holds None for places that were not found
+        """
+        self.search_slots = asyncio.Semaphore(self.concurrency)
+        self.inflight_searches = {}
+
+        async with httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency
+            )
+        ) as client:
+            if condo is None:
+                # Fetch condo location using Singapore coordinates
+                self.stdout.write(f"Fetching condo location: {condo_query}")
+                condo = await self.cached_search(client, condo_query, self.SINGAPORE_LAT, self.SINGAPORE_LNG)
+                if condo:
+                    self.stdout.write(self.style.SUCCESS(f"  ✓ Found: {condo['lat']}, {condo['lng']}"))
+
+            # Get condo coordinates for searching nearby locations
+            condo_lat = round(condo['lat'], 4) if condo else self.SINGAPORE_LAT
+            condo_lng = round(condo['lng'], 4) if condo else self.SINGAPORE_LNG
+
+            if places:
+                self.stdout.write(f"Fetching {len(places)} locations ({self.concurrency} at a time)...")
+            coords_list = await asyncio.gather(
+                *(self.cached_search(client, place, condo_lat, condo_lng) for place in places)
+            )
+
+        return condo, coords_list
+
     async def categorize_locations(self, locations_by_category):
         """
         Use OpenAI GPT to assign subcategories to each location.
@@ -120,6 +290,8 @@ class Command(BaseCommand):
         # Prepare batch requests for all locations
         params_list = []
         location_refs = []  # Keep track of which location each request corresponds to
+        request_indices = {}  # (title, address, category) -> index of its request in params_list
+        dup_refs = []  # Locations sharing an earlier location's request, as (category, location, index)
         
         for category, locations in locations_by_category.items():
             for location in locations:
@@ -128,6 +300,13 @@ class Command(BaseCommand):
                     self.stdout.write(self.style.SUCCESS(f"✓ {location['title']} already has subcategory: {location['subcategory']}"))
                     continue
                 
+                # Identical prompts (e.g. chain outlets at the same address) share one request
+                prompt_key = (location['title'], location.get('address', ''), category)
+                if prompt_key in request_indices:
+                    dup_refs.append((category, location, request_indices[prompt_key]))
+                    continue
+                request_indices[prompt_key] = len(params_list)
+                
                 # Create GPT request for this location
                 params = {
                     'model': 'gpt-4o-mini',
@@ -153,11 +332,16 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS("✓ All locations already categorized"))
             return locations_by_category
         
-        # Make concurrent GPT requests
-        self.stdout.write(f"Making {len(params_list)} GPT requests...")
-        outputs, total_cost = await gpt_request(__name__, params_list)
+        # Make concurrent GPT requests (openai is only imported when there is work to do)
+        from gpt import client_session, gpt_request
+
+        self.stdout.write(f"Making {len(params_list)} GPT requests for {len(location_refs) + len(dup_refs)} locations...")
+        async with client_session():
+            outputs, total_cost = await gpt_request(__name__, params_list)
         
         # Update locations with subcategories
+        location_refs.extend((category, location) for category, location, _ in dup_refs)
+        outputs.extend(outputs[i] for _, _, i in dup_refs)
         for i, output in enumerate(outputs):
             category, location = location_refs[i]
             if isinstance(output, LocationSubcategory):
@@ -180,103 +364,120 @@ class Command(BaseCommand):
         return locations_by_category
 
     def handle(self, *args, **options):
-        # Get command arguments
-        location_queries = options['locations']
+        # Get command arguments (names differing only in case or spacing are looked up once)
+        queries_by_name = {}
+        for place in options['locations']:
+            queries_by_name.setdefault(self.canonical_query(place), place)
+        location_queries = list(queries_by_name.values())
         category_name = options['category']
         condo_query = options['condo']
+        self.refresh = options['refresh']
+        self.concurrency = max(1, options['concurrency'])
+        self.rate_limiter = RateLimiter(options['rate'])
+
+        # Get API key
+        try:
+            self.api_key = self.get_api_key(options)
+        except ValueError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
+
+        self.cache = ResponseCache(self.SERPAPI_CACHE_PATH, self.SERPAPI_CACHE_TTL)
         
         # Determine the output path
-        output_path = os.path.join(
-            settings.BASE_DIR,
-            'location_map',
-            'static',
-            'location_map',
-            'coordinates_results.json'
-        )
+        output_path = COORDINATES_PATH
         
         # Load existing data if file exists
         existing_data = {"condo": None, "locations": {}}
         if os.path.exists(output_path):
             try:
-                with open(output_path, "r", encoding="utf-8") as f:
-                    existing_data = json.load(f)
+                existing_data = load_json(output_path)
                 self.stdout.write(self.style.SUCCESS(f"✓ Loaded existing data from {output_path}"))
             except Exception as e:
                 self.stdout.write(self.style.WARNING(f"⚠ Could not load existing file: {e}"))
         
         # Check if condo already exists
+        condo = None
         if existing_data.get("condo") and existing_data["condo"].get("name") == condo_query:
             self.stdout.write(self.style.SUCCESS(f"✓ Condo already exists: {condo_query} (skipping)"))
             condo = existing_data["condo"]
-        else:
-            # Fetch condo location using Singapore coordinates
-            self.stdout.write(f"Fetching condo location: {condo_query}")
-            condo = self.search_location(condo_query, lat=self.SINGAPORE_LAT, lng=self.SINGAPORE_LNG)
-            if condo:
-                self.stdout.write(self.style.SUCCESS(f"  ✓ Found: {condo['lat']}, {condo['lng']}"))
-        
-        # Get condo coordinates for searching nearby locations
-        condo_lat = round(condo['lat'], 4) if condo else self.SINGAPORE_LAT
-        condo_lng = round(condo['lng'], 4) if condo else self.SINGAPORE_LNG
         
         # Start with existing data
-        results = {
-            "condo": condo,
-            "locations": existing_data.get("locations", {})
-        }
+        locations = existing_data.get("locations", {})
         
         # Ensure category exists in results
-        if category_name not in results["locations"]:
-            results["locations"][category_name] = []
+        if category_name not in locations:
+            locations[category_name] = []
         
-        # Get existing location names in this category
-        existing_names = {loc.get("name") for loc in results["locations"][category_name]}
+        # Get existing location names in this category, and the first record for each name in any category
+        existing_names = {self.canonical_query(loc.get("name", "")) for loc in locations[category_name]}
+        all_existing = {}
+        for category, locs in locations.items():
+            for loc in locs:
+                all_existing.setdefault(self.canonical_query(loc.get("name", "")), (category, loc))
         
-        # Fetch coordinates for provided locations
         self.stdout.write(f"\n--- {category_name} ---")
         
+        # Skip locations that already exist in this category, and copy ones found in another
+        places_to_fetch = []
         for place in location_queries:
-            # Skip if location already exists in this category
-            if place in existing_names:
+            name_key = self.canonical_query(place)
+            if name_key in existing_names:
                 self.stdout.write(self.style.SUCCESS(f"✓ {place} already exists (skipping)"))
-                continue
-            
-            self.stdout.write(f"Fetching: {place}")
-            coords = self.search_location(place, lat=condo_lat, lng=condo_lng)
+            elif name_key in all_existing:
+                other_category, record = all_existing[name_key]
+                record = copy.deepcopy(record)
+                # Subcategories depend on the category, so let GPT assign a new one
+                record.pop("subcategory", None)
+                record.pop("subcategory_reasoning", None)
+                locations[category_name].append(record)
+                self.stdout.write(self.style.SUCCESS(f"✓ {place} copied from {other_category}"))
+            else:
+                places_to_fetch.append(place)
+        
+        # Fetch the condo and all new locations concurrently
+        condo, coords_list = asyncio.run(
+            self.fetch_all_locations(condo_query, condo, places_to_fetch)
+        )
+        self.cache.close()
+        
+        results = {
+            "condo": condo,
+            "locations": locations
+        }
+        
+        for place, coords in zip(places_to_fetch, coords_list):
             if coords:
                 results["locations"][category_name].append(coords)
-                self.stdout.write(self.style.SUCCESS(f"  ✓ Found: {coords['lat']}, {coords['lng']}"))
+                self.stdout.write(self.style.SUCCESS(f"  ✓ {place}: {coords['lat']}, {coords['lng']}"))
             else:
-                self.stdout.write(self.style.WARNING(f"  ✗ Not found"))
-            
-            # Rate limiting - wait 1 second between requests
-            time.sleep(1)
+                self.stdout.write(self.style.WARNING(f"  ✗ {place}: Not found"))
         
         # Categorize locations using GPT
         results["locations"] = asyncio.run(self.categorize_locations(results["locations"]))
         
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        # Save results to JSON file
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
-        
+        # Save results to JSON file (skipped if nothing changed)
+        written = write_json_atomic(output_path, results)
+
         self.stdout.write("\n" + "="*60)
-        self.stdout.write(self.style.SUCCESS(f"Results saved to {output_path}"))
+        if written:
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {output_path}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"No changes - {output_path} is up to date"))
         self.stdout.write("="*60)
         
-        # Print summary
-        self.stdout.write("\nCONDO LOCATION:")
+        # Print summary (built up and written once, as it lists every location)
+        lines = ["\nCONDO LOCATION:"]
         if condo:
-            self.stdout.write(f"  {condo['title']}")
-            self.stdout.write(f"  Coordinates: {condo['lat']}, {condo['lng']}")
+            lines.append(f"  {condo['title']}")
+            lines.append(f"  Coordinates: {condo['lat']}, {condo['lng']}")
         
-        self.stdout.write("\nLOCATIONS BY CATEGORY:")
+        lines.append("\nLOCATIONS BY CATEGORY:")
         for category, places in results["locations"].items():
-            self.stdout.write(f"\n{category}: {len(places)} locations")
+            lines.append(f"\n{category}: {len(places)} locations")
             for place in places:
-                subcategory = f" [{place.get('subcategory', 'N/A')}]" if 'subcategory' in place else ""
-                self.stdout.write(f"  - {place['title']}{subcategory}: {place['lat']}, {place['lng']}")
+                subcategory = f" [{place['subcategory']}]" if 'subcategory' in place else ""
+                lines.append(f"  - {place['title']}{subcategory}: {place['lat']}, {place['lng']}")
+        self.stdout.write("\n".join(lines))
         
         self.stdout.write(self.style.SUCCESS(f"\n✓ Successfully fetched {sum(len(places) for places in results['locations'].values())} locations"))
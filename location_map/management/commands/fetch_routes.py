@@ -2,26 +2,52 @@
 Django management command to pre-fetch all routes from condo to locations
 and update coordinates_results.json with cached route data.
 """
-import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 import googlemaps
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
+from location_map.utils import CACHE_DIR, COORDINATES_PATH, RateLimiter, ResponseCache, load_json, write_json_atomic
+
 
 class Command(BaseCommand):
     help = '''Pre-fetch all routes from condo to locations and cache them in coordinates_results.json
     
-    This command fetches routes for all travel modes (driving, walking, transit) between
-    the condo and all locations in the JSON file, then stores the encoded polylines and
-    travel information for instant loading without API calls.
+    This command fetches travel times and distances for all travel modes (driving, walking,
+    transit) between the condo and all locations in the JSON file using batched Distance
+    Matrix requests, plus the encoded driving polylines drawn on the map, and stores them
+    for instant loading without API calls.
     
     Examples:
         python manage.py fetch_routes
         python manage.py fetch_routes --api-key YOUR_GOOGLE_MAPS_API_KEY
+        python manage.py fetch_routes --workers 16 --delay 0.05
+        python manage.py fetch_routes --resume
     '''
 
+    # Directions API travel modes and the keys the frontend expects for them
+    TRAVEL_MODES = {
+        'driving': 'Drive',
+        'walking': 'Walk',
+        'transit': 'Transit',
+    }
+
+    # Modes whose route is drawn on the map and so needs a Directions API polyline
+    POLYLINE_MODES = ('driving',)
+
+    # Maximum destinations per Distance Matrix request
+    MATRIX_BATCH_SIZE = 25
+
+    # Routes are journaled as they arrive so an interrupted run can resume; the
+    # journal is removed once its routes are saved to coordinates_results.json
+    JOURNAL_PATH = os.path.join(CACHE_DIR, 'routes.jsonl')
+    JOURNAL_TTL = 24 * 60 * 60
+
+    # coordinates_results.json is also saved after every this many newly fetched locations
+    CHECKPOINT_INTERVAL = 25
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--api-key',
@@ -32,7 +58,19 @@ class Command(BaseCommand):
             '--delay',
             type=float,
             default=0.2,
-            help='Delay in seconds between API requests (default: 0.2)'
+            help='Minimum delay in seconds between starting API requests (default: 0.2)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Number of route requests to run in parallel (default: 8)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip locations whose routes were already looked up in every travel mode '
+                 'instead of refreshing their travel times'
         )
 
     def get_api_key(self, options):
@@ -63,6 +101,8 @@ class Command(BaseCommand):
             dict: Route data with encoded polyline and travel info, or None if failed
         """
         try:
+            # Wait for this request's turn under the shared rate limit
+            time.sleep(self.rate_limiter.reserve())
             result = gmaps_client.directions(
                 origin=origin,
                 destination=destination,
@@ -90,45 +130,203 @@ class Command(BaseCommand):
             )
             return None
 
-    def fetch_all_routes_for_location(self, gmaps_client, condo_coords, location, delay=0.2):
+    def fetch_route_summaries(self, gmaps_client, origin, destinations, mode):
         """
-        Fetch all travel modes (driving, walking, transit) for a single location
+        Fetch travel info to a batch of destinations with one Distance Matrix request
         
         Args:
+            gmaps_client: Google Maps client instance
+            origin: Origin coordinates as (lat, lng) tuple
+            destinations: Up to MATRIX_BATCH_SIZE (lat, lng) tuples
+            mode: Travel mode ('driving', 'walking', 'transit')
+            
+        Returns:
+            list: Travel info dict (or None if no route was found) for each destination, in order,
+                  or None if the request itself failed
+        """
+        try:
+            # Wait for this request's turn under the shared rate limit
+            time.sleep(self.rate_limiter.reserve())
+            result = gmaps_client.distance_matrix(
+                origins=[origin],
+                destinations=destinations,
+                mode=mode,
+                departure_time='now' if mode == 'transit' else None
+            )
+            elements = result['rows'][0]['elements']
+            
+        except Exception as e:
+            self.stdout.write(
+                self.style.WARNING(f"  ⚠ Failed to fetch {mode} distance matrix: {str(e)}")
+            )
+            return None
+        
+        summaries = []
+        for element in elements:
+            if element.get('status') != 'OK':
+                summaries.append(None)
+                continue
+            
+            summaries.append({
+                'duration': element['duration']['text'],
+                'distance': element.get('distance', {}).get('text', 'N/A'),
+                'duration_value': element['duration']['value'],  # in seconds
+                'distance_value': element.get('distance', {}).get('value', 0)  # in meters
+            })
+        
+        return summaries
+
+    def submit_route_summaries(self, executor, gmaps_client, condo_coords, locations):
+        """
+        Queue Distance Matrix requests for every travel mode, MATRIX_BATCH_SIZE locations at a time
+        
+        Args:
+            executor: ThreadPoolExecutor running the requests
             gmaps_client: Google Maps client instance
             condo_coords: Condo coordinates as (lat, lng) tuple
-            location: Location dict with lat/lng
-            delay: Delay between API requests in seconds
+            locations: Location dicts with lat/lng
             
         Returns:
-            dict: Route cache data for all travel modes
+            dict: Travel mode -> list of futures, one per batch of locations
         """
-        routes = {}
+        destinations = [(location['lat'], location['lng']) for location in locations]
+        return {
+            mode: [
+                executor.submit(
+                    self.fetch_route_summaries, gmaps_client, condo_coords,
+                    destinations[start:start + self.MATRIX_BATCH_SIZE], mode
+                )
+                for start in range(0, len(destinations), self.MATRIX_BATCH_SIZE)
+            ]
+            for mode in self.TRAVEL_MODES
+        }
+
+    def route_summary(self, summary_futures, mode, index):
+        """
+        Wait for a location's Distance Matrix result in one travel mode
         
+        Args:
+            summary_futures: Futures from submit_route_summaries
+            mode: Travel mode
+            index: Position of the location in the list given to submit_route_summaries
+            
+        Returns:
+            tuple: (answered, route_data) where answered is False if the batch request failed,
+                   and route_data is None when there is no route
+        """
+        batch, offset = divmod(index, self.MATRIX_BATCH_SIZE)
+        summaries = summary_futures[mode][batch].result()
+        if summaries is None:
+            return False, None
+        return True, summaries[offset]
+
+    def reachable_modes(self, summary_futures, index):
+        """
+        Wait for a location's Distance Matrix results and return the polyline modes it has a route for
+        
+        Args:
+            summary_futures: Futures from submit_route_summaries
+            index: Position of the location in the list given to submit_route_summaries
+            
+        Returns:
+            set: Travel modes from POLYLINE_MODES with a route to the location
+        """
+        return {
+            mode for mode in self.POLYLINE_MODES
+            if self.route_summary(summary_futures, mode, index)[1]
+        }
+
+    def submit_polylines_for_location(self, executor, gmaps_client, condo_coords, location, reachable_modes):
+        """
+        Queue Directions API requests for the reachable polyline modes a location has no cached polyline for
+        
+        Args:
+            executor: ThreadPoolExecutor running the requests
+            gmaps_client: Google Maps client instance
+            condo_coords: Condo coordinates as (lat, lng) tuple
+            location: Location dict with lat/lng and optional cached_routes
+            reachable_modes: Modes the Distance Matrix found a route for, from reachable_modes
+            
+        Returns:
+            dict: Travel mode -> cached polyline string, or future for a fetch_route result
+        """
         destination = (location['lat'], location['lng'])
+        cached_routes = location.get('cached_routes') or {}
+        polylines = {}
         
-        for mode in ['driving', 'walking', 'transit']:
-            route_data = self.fetch_route(gmaps_client, condo_coords, destination, mode)
+        for mode in self.POLYLINE_MODES:
+            # No route means no polyline to fetch
+            if mode not in reachable_modes:
+                continue
             
-            if route_data:
-                # Capitalize first letter for consistency with frontend
-                mode_key = mode.capitalize() if mode != 'transit' else 'Transit'
-                if mode_key == 'Driving':
-                    mode_key = 'Drive'
-                elif mode_key == 'Walking':
-                    mode_key = 'Walk'
-                
-                routes[mode_key] = route_data
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f"    ✓ {mode_key}: {route_data['duration']} ({route_data['distance']})"
-                    )
-                )
+            cached_polyline = cached_routes.get(self.TRAVEL_MODES[mode], {}).get('encoded_polyline')
+            if cached_polyline:
+                polylines[mode] = cached_polyline
+            else:
+                polylines[mode] = executor.submit(self.fetch_route, gmaps_client, condo_coords, destination, mode)
+        
+        return polylines
+
+    def collect_routes(self, summary_futures, index, polylines):
+        """
+        Assemble one location's routes from the batched results and report each one
+        
+        Args:
+            summary_futures: Futures from submit_route_summaries
+            index: Position of the location in the list given to submit_route_summaries
+            polylines: Cached polylines / futures from submit_polylines_for_location
+            
+        Returns:
+            tuple: (routes, modes_looked_up) - route cache data for all travel modes that
+                   succeeded, and the travel modes whose lookups all completed, whether or
+                   not they found a route
+        """
+        routes = {}
+        modes_looked_up = []
+        
+        for mode, mode_key in self.TRAVEL_MODES.items():
+            answered, route_data = self.route_summary(summary_futures, mode, index)
+            if not route_data:
+                if answered:
+                    modes_looked_up.append(mode)
+                continue
+            
+            if mode in polylines:
+                polyline = polylines[mode]
+                if not isinstance(polyline, str):
+                    directions = polyline.result()
+                    polyline = directions['encoded_polyline'] if directions else None
+                if polyline:
+                    route_data = {'encoded_polyline': polyline, **route_data}
+                    modes_looked_up.append(mode)
+            else:
+                modes_looked_up.append(mode)
             
-            # Rate limiting
-            time.sleep(delay)
+            routes[mode_key] = route_data
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"    ✓ {mode_key}: {route_data['duration']} ({route_data['distance']})"
+                )
+            )
         
-        return routes
+        return routes, modes_looked_up
+
+    def is_fetched(self, location):
+        """
+        Whether every travel mode has already been looked up for a location
+        
+        Modes with no route (often Transit) count once they have been looked up,
+        as recorded in route_modes; files written before route_modes existed
+        count when they hold routes for every mode.
+        """
+        if 'route_modes' in location:
+            return set(self.TRAVEL_MODES) <= set(location['route_modes'])
+        return set(self.TRAVEL_MODES.values()) <= (location.get('cached_routes') or {}).keys()
+
+    @staticmethod
+    def journal_key(origin, location):
+        """Return the journal key for the routes from origin to a location."""
+        return f"{origin[0]},{origin[1]}|{location['lat']},{location['lng']}"
 
     def handle(self, *args, **options):
         # Get API key
@@ -141,17 +339,12 @@ class Command(BaseCommand):
         # Initialize Google Maps client
         gmaps_client = googlemaps.Client(key=api_key)
         
-        # Get delay
+        # Space request starts by the delay, shared across all worker threads
         delay = options['delay']
+        self.rate_limiter = RateLimiter(1 / delay if delay > 0 else 0)
         
         # Determine the file path
-        json_path = os.path.join(
-            settings.BASE_DIR,
-            'location_map',
-            'static',
-            'location_map',
-            'coordinates_results.json'
-        )
+        json_path = COORDINATES_PATH
         
         # Load existing data
         if not os.path.exists(json_path):
@@ -161,8 +354,7 @@ class Command(BaseCommand):
             return
         
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_json(json_path)
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f"Error loading JSON file: {e}")
@@ -189,45 +381,105 @@ class Command(BaseCommand):
         # Track statistics
         total_locations = 0
         total_routes_fetched = 0
+        total_routes_reused = 0
         total_routes_failed = 0
         
-        # Iterate through all categories and locations
+        # Reuse routes saved by a previous run that was interrupted and, with
+        # --resume, routes already looked up in every travel mode
+        journal = ResponseCache(self.JOURNAL_PATH, self.JOURNAL_TTL)
+        pending = []
         for category, locations in data['locations'].items():
-            self.stdout.write(f"\n--- {category} ({len(locations)} locations) ---")
-            
             for location in locations:
-                location_name = location.get('title') or location.get('name')
-                self.stdout.write(f"  {location_name}")
-                
-                # Fetch routes for this location
-                routes = self.fetch_all_routes_for_location(
-                    gmaps_client,
-                    condo_coords,
-                    location,
-                    delay=delay
-                )
-                
-                # Store routes in location data
-                location['cached_routes'] = routes
+                resumed = journal.get(self.journal_key(condo_coords, location))
+                if resumed is None and options['resume'] and self.is_fetched(location):
+                    resumed = {
+                        'cached_routes': location.get('cached_routes') or {},
+                        'route_modes': location.get('route_modes', list(self.TRAVEL_MODES)),
+                    }
+                pending.append((category, location, resumed))
+        to_fetch = [location for _, location, resumed in pending if resumed is None]
+        if len(to_fetch) < len(pending):
+            self.stdout.write(f"Resuming: {len(pending) - len(to_fetch)} locations already fetched")
+        
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            try:
+                # Queue batched travel info for all locations, then the polylines not
+                # already cached, skipping locations the Distance Matrix found no route to
+                summary_futures = self.submit_route_summaries(executor, gmaps_client, condo_coords, to_fetch)
+                polylines = [
+                    self.submit_polylines_for_location(
+                        executor, gmaps_client, condo_coords, location,
+                        self.reachable_modes(summary_futures, index)
+                    )
+                    for index, location in enumerate(to_fetch)
+                ]
                 
-                # Update statistics
-                total_locations += 1
-                total_routes_fetched += len(routes)
-                total_routes_failed += (3 - len(routes))  # 3 modes expected
+                # Report results in file order as they complete
+                current_category = None
+                index = 0
+                for category, location, resumed in pending:
+                    if category != current_category:
+                        current_category = category
+                        self.stdout.write(f"\n--- {category} ({len(data['locations'][category])} locations) ---")
+                    
+                    location_name = location.get('title') or location.get('name')
+                    self.stdout.write(f"  {location_name}")
+                    
+                    # Store routes in location data, journaling new ones straight away
+                    if resumed is not None:
+                        routes, route_modes = resumed['cached_routes'], resumed['route_modes']
+                        self.stdout.write(f"    ✓ {len(routes)} routes already fetched")
+                    else:
+                        routes, route_modes = self.collect_routes(summary_futures, index, polylines[index])
+                        index += 1
+                        if route_modes:
+                            journal.set(
+                                self.journal_key(condo_coords, location),
+                                {'cached_routes': routes, 'route_modes': route_modes}
+                            )
+                    location['cached_routes'] = routes
+                    location['route_modes'] = route_modes
+                    
+                    # Checkpoint progress into the JSON file itself
+                    if resumed is None and index % self.CHECKPOINT_INTERVAL == 0:
+                        write_json_atomic(json_path, data)
+                    
+                    # Update statistics
+                    total_locations += 1
+                    if resumed is not None:
+                        total_routes_reused += len(routes)
+                    else:
+                        total_routes_fetched += len(routes)
+                        total_routes_failed += (len(self.TRAVEL_MODES) - len(routes))
+            
+            except BaseException:
+                # On Ctrl-C or an error, drop queued requests rather than paying for
+                # results that would be thrown away
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        
+        journal.close()
         
         # Save updated data back to file
         try:
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            written = write_json_atomic(json_path, data)
             
+            # Every journaled route is now in the JSON file
+            if os.path.exists(self.JOURNAL_PATH):
+                os.remove(self.JOURNAL_PATH)
+
             self.stdout.write("\n" + "="*60)
-            self.stdout.write(self.style.SUCCESS(f"✓ Routes saved to {json_path}"))
+            if written:
+                self.stdout.write(self.style.SUCCESS(f"✓ Routes saved to {json_path}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"✓ No changes - {json_path} is up to date"))
             self.stdout.write("="*60)
             
             # Print summary
             self.stdout.write("\nSUMMARY:")
             self.stdout.write(f"  Total locations: {total_locations}")
             self.stdout.write(f"  Routes fetched: {total_routes_fetched}")
+            self.stdout.write(f"  Routes reused: {total_routes_reused}")
             self.stdout.write(f"  Routes failed: {total_routes_failed}")
             self.stdout.write(
                 self.style.SUCCESS(
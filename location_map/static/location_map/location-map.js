@@ -445,8 +445,13 @@ class LocationExplorer {
   }
 }
 
-// Load location data from JSON file
+// Load location data embedded in the page, or from the JSON file
 async function loadLocationData() {
+  const embedded = document.getElementById("location-data");
+  if (embedded) {
+    return JSON.parse(embedded.textContent);
+  }
+
   try {
     const response = await fetch(
       "/static/location_map/coordinates_results.json"
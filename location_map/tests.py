@@ -1,3 +1,404 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from location_map.management.commands import fetch_coordinates, fetch_routes
+from location_map.utils import RateLimiter, ResponseCache, write_json_atomic
+
+
+class TempDirMixin:
+    """Give each test its own temporary directory, removed afterwards."""
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+
+
+class WriteJsonAtomicTests(TempDirMixin, SimpleTestCase):
+
+    def test_writes_and_skips_unchanged_content(self):
+        path = os.path.join(self.tmp_dir, 'data.json')
+
+        self.assertTrue(write_json_atomic(path, {'a': 'é'}))
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'a': 'é'})
+        mtime = os.stat(path).st_mtime_ns
+
+        self.assertFalse(write_json_atomic(path, {'a': 'é'}))
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+        self.assertTrue(write_json_atomic(path, {'a': 'b'}))
+        self.assertEqual(os.listdir(self.tmp_dir), ['data.json'])
+
+
+class ResponseCacheTests(TempDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tmp_dir, 'cache.jsonl')
+
+    def test_entries_survive_reload(self):
+        cache_file = ResponseCache(self.path, ttl=60)
+        cache_file.set('a', {'lat': 1})
+        cache_file.set('a', {'lat': 2})
+        cache_file.close()
+
+        self.assertEqual(ResponseCache(self.path, ttl=60).get('a'), {'lat': 2})
+
+    def test_truncated_last_line_is_ignored(self):
+        cache_file = ResponseCache(self.path, ttl=60)
+        cache_file.set('a', 1)
+        cache_file.close()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"key": "b", "stored_at": ')
+
+        reloaded = ResponseCache(self.path, ttl=60)
+        self.assertEqual(reloaded.get('a'), 1)
+        self.assertIsNone(reloaded.get('b'))
+
+    def test_expired_entries_are_missing(self):
+        cache_file = ResponseCache(self.path, ttl=60)
+        with mock.patch('location_map.utils.time.time', return_value=1000):
+            cache_file.set('a', 1)
+        with mock.patch('location_map.utils.time.time', return_value=1059):
+            self.assertEqual(cache_file.get('a'), 1)
+        with mock.patch('location_map.utils.time.time', return_value=1061):
+            self.assertIsNone(cache_file.get('a'))
+        cache_file.close()
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    def test_reserve_spaces_calls(self):
+        limiter = RateLimiter(10)
+        with mock.patch('location_map.utils.time.monotonic', return_value=100.0):
+            waits = [limiter.reserve() for _ in range(3)]
+        for wait, expected in zip(waits, [0, 0.1, 0.2]):
+            self.assertAlmostEqual(wait, expected)
+
+    def test_zero_rate_disables_limiting(self):
+        limiter = RateLimiter(0)
+        self.assertEqual([limiter.reserve() for _ in range(3)], [0, 0, 0])
+
+
+PLACE_RESPONSE = {
+    'local_results': [
+        {'title': 'Pasir Ris Park', 'gps_coordinates': {'latitude': 1.38, 'longitude': 103.95}}
+    ]
+}
+
+
+class SerpApiSearchTests(TempDirMixin, SimpleTestCase):
+    """fetch_coordinates searches, run against an httpx.MockTransport."""
+
+    def setUp(self):
+        super().setUp()
+        self.command = fetch_coordinates.Command(stdout=io.StringIO(), stderr=io.StringIO())
+        self.command.api_key = 'test-key'
+        self.command.refresh = False
+        self.command.rate_limiter = RateLimiter(0)
+        self.command.cache = ResponseCache(os.path.join(self.tmp_dir, 'serpapi.jsonl'), ttl=60)
+        self.addCleanup(self.command.cache.close)
+        self.requests = []
+
+    def search(self, handler, *queries):
+        def record(request):
+            self.requests.append(request)
+            return handler(request)
+
+        async def run():
+            self.command.search_slots = asyncio.Semaphore(5)
+            self.command.inflight_searches = {}
+            async with httpx.AsyncClient(transport=httpx.MockTransport(record)) as client:
+                return await asyncio.gather(
+                    *(self.command.cached_search(client, query, 1.38, 103.95) for query in queries)
+                )
+
+        return asyncio.run(run())
+
+    def test_transient_errors_are_retried(self):
+        responses = iter([httpx.Response(503), httpx.Response(429, headers={'Retry-After': '0'})])
+
+        def handler(request):
+            return next(responses, None) or httpx.Response(200, json=PLACE_RESPONSE)
+
+        with mock.patch.object(self.command, 'RETRY_BACKOFF', 0):
+            [result] = self.search(handler, 'Pasir Ris Park')
+
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(result['lat'], 1.38)
+
+    def test_gives_up_after_max_retries(self):
+        with mock.patch.object(self.command, 'RETRY_BACKOFF', 0):
+            [result] = self.search(lambda request: httpx.Response(500), 'Pasir Ris Park')
+
+        self.assertIsNone(result)
+        self.assertEqual(len(self.requests), self.command.MAX_RETRIES + 1)
+
+    def test_equivalent_queries_share_one_request_and_the_cache(self):
+        handler = lambda request: httpx.Response(200, json=PLACE_RESPONSE)
+
+        first, second = self.search(handler, 'Pasir Ris Park', 'pasir ris  park')
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual((first['name'], second['name']), ('Pasir Ris Park', 'pasir ris  park'))
+
+        [cached] = self.search(handler, 'PASIR RIS PARK')
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(cached['lat'], 1.38)
+
+
+class FetchCoordinatesTests(TempDirMixin, SimpleTestCase):
+    """fetch_coordinates with the SerpAPI search and GPT categorization stubbed out."""
+
+    def setUp(self):
+        super().setUp()
+        self.json_path = os.path.join(self.tmp_dir, 'coordinates_results.json')
+        self.searches = []
+
+        async def search_location(command, client, query, lat=None, lng=None):
+            self.searches.append(query)
+            return {'name': query, 'title': query.title(), 'lat': 1.38, 'lng': 103.95}
+
+        async def categorize_locations(command, locations_by_category):
+            return locations_by_category
+
+        for patcher in (
+            mock.patch.object(fetch_coordinates, 'COORDINATES_PATH', self.json_path),
+            mock.patch.object(
+                fetch_coordinates.Command, 'SERPAPI_CACHE_PATH', os.path.join(self.tmp_dir, 'serpapi.jsonl')
+            ),
+            mock.patch.object(fetch_coordinates.Command, 'search_location', search_location),
+            mock.patch.object(fetch_coordinates.Command, 'categorize_locations', categorize_locations),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_command(self, *args):
+        call_command(
+            fetch_coordinates.Command(), '--api-key', 'test-key', '--rate', '0', *args,
+            stdout=io.StringIO()
+        )
+
+    def load_names(self, category):
+        with open(self.json_path, encoding='utf-8') as f:
+            return [place['name'] for place in json.load(f)['locations'][category]]
+
+    def test_names_differing_in_case_or_spacing_are_fetched_once(self):
+        self.run_command('Pasir Ris Park', 'pasir ris  park', '--category', 'Parks')
+        self.run_command('PASIR RIS PARK', '--category', 'Parks')
+
+        self.assertEqual(self.load_names('Parks'), ['Pasir Ris Park'])
+        # One search for the condo and one for the park
+        self.assertEqual(len(self.searches), 2)
+
+    def test_places_found_in_another_category_are_copied(self):
+        self.run_command('Pasir Ris Park', '--category', 'Parks')
+        self.run_command('pasir ris park', '--category', 'Beaches')
+
+        self.assertEqual(self.load_names('Beaches'), ['Pasir Ris Park'])
+        self.assertEqual(len(self.searches), 2)
+
+
+class FakeGoogleMapsClient:
+    """Stand-in for googlemaps.Client that records requests.
+
+    Locations north of NO_TRANSIT_LAT have no transit route, directions to
+    FAIL_AT fail with an error, and directions to INTERRUPT_AT raise
+    KeyboardInterrupt to simulate a run stopped partway.
+    """
+
+    NO_TRANSIT_LAT = 1.40
+    FAIL_AT = None
+    INTERRUPT_AT = None
+
+    def __init__(self, key=None):
+        self.matrix_requests = []
+        self.directions_requests = []
+        self.interrupted = False
+
+    def distance_matrix(self, origins, destinations, mode, departure_time=None):
+        self.matrix_requests.append((mode, list(destinations)))
+        elements = []
+        for lat, lng in destinations:
+            if mode == 'transit' and lat > self.NO_TRANSIT_LAT:
+                elements.append({'status': 'ZERO_RESULTS'})
+            else:
+                elements.append({
+                    'status': 'OK',
+                    'duration': {'text': f'{mode} time', 'value': 600},
+                    'distance': {'text': '2 km', 'value': 2000},
+                })
+        return {'rows': [{'elements': elements}]}
+
+    def directions(self, origin, destination, mode, departure_time=None):
+        if self.interrupted:
+            # Requests still take a while after Ctrl-C, so the command sees it first
+            time.sleep(0.05)
+        if destination == self.INTERRUPT_AT:
+            self.interrupted = True
+            raise KeyboardInterrupt
+        if destination == self.FAIL_AT:
+            raise OSError('connection reset')
+        self.directions_requests.append((mode, destination))
+        return [{
+            'overview_polyline': {'points': f'polyline-{destination[0]}'},
+            'legs': [{'duration': {'text': '5 mins', 'value': 300}, 'distance': {'text': '2 km', 'value': 2000}}],
+        }]
+
+
+class FetchRoutesTests(TempDirMixin, SimpleTestCase):
+    """fetch_routes against a fake Google Maps client and a temporary coordinates file."""
+
+    LOCATION_COUNT = 30
+
+    def setUp(self):
+        super().setUp()
+        self.json_path = os.path.join(self.tmp_dir, 'coordinates_results.json')
+        self.journal_path = os.path.join(self.tmp_dir, 'routes.jsonl')
+        # Only every third location has a transit route
+        self.locations = [
+            {'name': f'Place {i}', 'lat': 1.40 + 0.001 * (i % 3) + 0.00001 * i, 'lng': 103.9}
+            for i in range(self.LOCATION_COUNT)
+        ]
+        with open(self.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'condo': {'title': 'Condo', 'lat': 1.37, 'lng': 103.95},
+                'locations': {'Shops': self.locations[:20], 'Parks': self.locations[20:]},
+            }, f)
+
+        for patcher in (
+            mock.patch.object(fetch_routes, 'COORDINATES_PATH', self.json_path),
+            mock.patch.object(fetch_routes.Command, 'JOURNAL_PATH', self.journal_path),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_command(self, *args, client=None):
+        self.client = client or FakeGoogleMapsClient()
+        with mock.patch.object(fetch_routes.googlemaps, 'Client', return_value=self.client):
+            call_command(
+                fetch_routes.Command(), '--api-key', 'test-key', '--delay', '0', *args,
+                stdout=io.StringIO()
+            )
+
+    def load_locations(self):
+        with open(self.json_path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data['locations']['Shops'] + data['locations']['Parks']
+
+    def test_travel_info_is_batched_per_mode(self):
+        self.run_command()
+
+        batch_sizes = sorted((mode, len(destinations)) for mode, destinations in self.client.matrix_requests)
+        self.assertEqual(batch_sizes, [
+            ('driving', 5), ('driving', 25), ('transit', 5), ('transit', 25), ('walking', 5), ('walking', 25),
+        ])
+        # Only the drawn driving route needs a directions request
+        self.assertEqual({mode for mode, _ in self.client.directions_requests}, {'driving'})
+        self.assertEqual(len(self.client.directions_requests), self.LOCATION_COUNT)
+
+        first, second = self.load_locations()[:2]
+        self.assertEqual(first['cached_routes']['Drive']['encoded_polyline'], f"polyline-{first['lat']}")
+        self.assertEqual(first['cached_routes']['Walk']['duration'], 'walking time')
+        self.assertNotIn('encoded_polyline', first['cached_routes']['Walk'])
+        self.assertNotIn('Transit', second['cached_routes'])
+        self.assertEqual(second['route_modes'], ['driving', 'walking', 'transit'])
+        self.assertFalse(os.path.exists(self.journal_path))
+
+    def test_rerun_skips_locations_already_looked_up(self):
+        self.run_command()
+        self.run_command('--resume')
+
+        # Locations with no transit route are not looked up again either
+        self.assertEqual(self.client.matrix_requests, [])
+        self.assertEqual(self.client.directions_requests, [])
+
+        # Without --resume travel times are refreshed, but cached driving polylines are reused
+        self.run_command()
+        self.assertEqual(len(self.client.matrix_requests), 6)
+        self.assertEqual(self.client.directions_requests, [])
+
+    def test_failed_polyline_is_fetched_again(self):
+        failing = FakeGoogleMapsClient()
+        failing.FAIL_AT = (self.locations[0]['lat'], self.locations[0]['lng'])
+        self.run_command(client=failing)
+
+        first = self.load_locations()[0]
+        self.assertNotIn('encoded_polyline', first['cached_routes']['Drive'])
+        self.assertEqual(first['route_modes'], ['walking', 'transit'])
+
+        self.run_command('--resume')
+        self.assertEqual(self.client.directions_requests, [('driving', failing.FAIL_AT)])
+        self.assertEqual(self.load_locations()[0]['route_modes'], ['driving', 'walking', 'transit'])
+
+    def test_interrupted_run_resumes_from_journal_and_checkpoint(self):
+        interrupted = FakeGoogleMapsClient()
+        interrupted.INTERRUPT_AT = (self.locations[15]['lat'], self.locations[15]['lng'])
+
+        with mock.patch.object(fetch_routes.Command, 'CHECKPOINT_INTERVAL', 10):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_command('--workers', '1', client=interrupted)
+
+        # Queued requests are cancelled rather than run and thrown away
+        self.assertLess(len(interrupted.directions_requests), 20)
+        # The checkpoint holds the first 10 locations; the journal has all 15 collected
+        saved = self.load_locations()
+        self.assertTrue(all('cached_routes' in location for location in saved[:10]))
+        self.assertFalse(any('cached_routes' in location for location in saved[10:]))
+        with open(self.journal_path, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 15)
+
+        self.run_command()
+
+        fetched = {destination for _, destination in self.client.directions_requests}
+        self.assertEqual(fetched, {(location['lat'], location['lng']) for location in self.locations[15:]})
+        self.assertTrue(all(location['route_modes'] for location in self.load_locations()))
+        self.assertFalse(os.path.exists(self.journal_path))
+
+
+class IndexViewTests(TempDirMixin, SimpleTestCase):
+    """The map page embeds coordinates_results.json when it can be read."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.path = os.path.join(self.tmp_dir, 'coordinates_results.json')
+        patcher = mock.patch('location_map.views.COORDINATES_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_embeds_location_data(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"condo": {"name": "Condo"}, "locations": {}}')
+
+        response = self.client.get(reverse('location_map:index'))
+
+        self.assertContains(response, '<script id="location-data" type="application/json">')
+        self.assertContains(response, '"name": "Condo"')
+
+    def test_missing_file_leaves_data_out(self):
+        response = self.client.get(reverse('location_map:index'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'location-data')
+        self.assertNotContains(response, 'None')
+
+    def test_corrupt_file_leaves_data_out(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"condo": ')
+
+        response = self.client.get(reverse('location_map:index'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'location-data')
@@ -0,0 +1,152 @@
+"""
+Shared helpers for the location_map management commands.
+"""
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# orjson is optional; it loads and dumps the coordinates file several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Location data consumed by the front-end map
+COORDINATES_PATH = os.path.join(
+    settings.BASE_DIR,
+    'location_map',
+    'static',
+    'location_map',
+    'coordinates_results.json'
+)
+
+# Untracked working directory for API response caches
+CACHE_DIR = os.path.join(settings.BASE_DIR, '.cache', 'location_map')
+
+
+def load_json(path):
+    """Load a JSON file, using orjson when it is installed."""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dump_json(data):
+    """
+    Encode data as 2-space indented UTF-8 JSON bytes.
+
+    orjson is used when installed and produces the same bytes as the stdlib
+    json fallback, so switching between them never rewrites an unchanged file.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def write_json_atomic(path, data):
+    """
+    Write data as JSON to path without ever leaving a partially-written file.
+
+    The payload is encoded once, written to a sibling temp file and swapped
+    into place with os.replace, which is atomic on POSIX and Windows. If the
+    file already holds exactly these bytes the write is skipped, so reruns
+    that change nothing leave the file (and its mtime) untouched.
+
+    Returns:
+        bool: True if the file was written, False if it was already current
+    """
+    payload = dump_json(data)
+
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == payload:
+                return False
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return True
+
+
+class ResponseCache:
+    """
+    Persistent key -> JSON value cache backed by an append-only JSON Lines file.
+    
+    Each set() appends one line and flushes it straight away, so results are
+    on disk as soon as they arrive and a crash mid-run loses nothing already
+    fetched. On load, later lines for a key override earlier ones and a
+    truncated final line is ignored. Entries older than ttl seconds are
+    treated as missing. Call close() when the run is done.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self._file = None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[record['key']] = record
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry['stored_at'] > self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        record = {'key': key, 'stored_at': time.time(), 'value': value}
+        self.entries[key] = record
+
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+
+class RateLimiter:
+    """
+    Space API calls at least 1/rate seconds apart, across threads and tasks.
+
+    reserve() books the next free slot and returns how many seconds the
+    caller must wait before making its call; sync code passes that to
+    time.sleep and async code to asyncio.sleep. A rate of 0 disables
+    limiting.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
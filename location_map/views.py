@@ -1,10 +1,37 @@
+import os
+
+from django.core.cache import cache
 from django.shortcuts import render
 from django.conf import settings
+from django.utils.html import json_script
+
+from .utils import COORDINATES_PATH, load_json
+
+
+def location_data_script():
+    """
+    Return coordinates_results.json as a json_script tag for embedding in the page.
+
+    The tag is cached under the file's mtime, so the JSON is only parsed and
+    re-encoded when the management commands rewrite the file; stale entries
+    simply expire. A missing or unreadable file gives an empty string, leaving
+    the page's script to fetch the file itself.
+    """
+    try:
+        mtime = os.path.getmtime(COORDINATES_PATH)
+        return cache.get_or_set(
+            f'location_map:coordinates:{mtime}',
+            lambda: json_script(load_json(COORDINATES_PATH), 'location-data'),
+            timeout=60 * 60
+        )
+    except (OSError, ValueError):
+        return ''
 
 
 def index(request):
     """Render the location map page."""
     context = {
         'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY,
+        'location_data_script': location_data_script(),
     }
     return render(request, 'location_map/index.html', context)